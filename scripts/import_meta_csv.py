@@ -1,18 +1,43 @@
 """
 Carga incremental de reportes publicitarios a un modelo estrella en SQL Server.
 
-- Lee un archivo CSV (86 columnas) usando pandas.
-- Aplica lógica de "buscar o crear" para las tablas de dimensiones.
-- Elimina la métrica diaria existente y luego inserta la nueva en una sola transacción.
-- Maneja errores por fila, permitiendo continuar con las siguientes.
+- Lee un archivo CSV (86 columnas) o su conversión a Parquet en bloques de
+  ``BATCH_SIZE`` filas, con el lector multihilo de PyArrow si está instalado
+  y con pandas en caso contrario.
+- Da de alta las dimensiones nuevas con un MERGE por lote desde tablas
+  temporales y resuelve las claves sustitutas en memoria.
+- Reparte las métricas de cada lote entre ``WORKERS`` hilos, cada uno con su
+  propia conexión; cada hilo las carga en ``#staging_fact`` (``BULK INSERT`` o
+  ``fast_executemany``) y las aplica con un único MERGE sobre ``fact_Metrics``
+  y un commit.
+- Aplica cada tramo de métricas dentro de un savepoint: si falla, lo repite
+  fila a fila para descartar solo las filas erróneas y continuar.
 """
 from __future__ import annotations
 
+import os
 import sys
-from datetime import datetime
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Iterator, NamedTuple
 import pandas as pd
 import pyodbc
 
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+except ImportError:  # PyArrow es opcional: sin él se usa el lector C de pandas.
+    pa = None
+
+try:
+    from tqdm import tqdm
+except ImportError:  # tqdm es opcional: sin él se informa una línea por lote.
+    tqdm = None
+
 # ---------------------------------------------------------------------------
 # Configuración
 # ---------------------------------------------------------------------------
@@ -20,7 +45,19 @@ SERVER = "localhost\\SQLEXPRESS"
 DATABASE = "MarketingDW"
 USERNAME = "sa"
 PASSWORD = "yourStrong(!)Password"
+# Admite también un .parquet generado una vez con csv_to_parquet().
 CSV_PATH = "reporte.csv"
+BATCH_SIZE = 10_000
+BATCH_RETRIES = 2
+CACHE_SIZE = 10_000
+WORKERS = 8
+# Carpeta visible con la misma ruta desde este script y desde SQL Server
+# (p. ej. un recurso compartido UNC). Con None se usa fast_executemany.
+BULK_DIR: str | None = None
+# Tuplas por llamada a executemany: acota la memoria de parámetros por hilo.
+EXECUTEMANY_ROWS = 1_000
+# Filas por savepoint dentro de la transacción de cada partición.
+SAVEPOINT_ROWS = 5_000
 
 CONN_STR = (
     f"DRIVER={{ODBC Driver 17 for SQL Server}};"
@@ -29,267 +66,1018 @@ CONN_STR = (
     f"UID={USERNAME};"
     f"PWD={PASSWORD};"
     "TrustServerCertificate=yes;"
+    "MARS_Connection=yes;"
+    "APP=meta_csv_importer;"
 )
+# El driver ODBC no acepta el tamaño de paquete en la cadena de conexión: se
+# fija con el atributo SQL_ATTR_PACKET_SIZE (pyodbc no expone la constante).
+SQL_ATTR_PACKET_SIZE = 112
+PACKET_SIZE = 32_767
+
+
+def connect() -> pyodbc.Connection:
+    return pyodbc.connect(
+        CONN_STR, autocommit=False, attrs_before={SQL_ATTR_PACKET_SIZE: PACKET_SIZE}
+    )
+
+
+def is_transient(err: pyodbc.Error) -> bool:
+    """Indica si vale la pena reintentar: interbloqueo o espera agotada.
+
+    Los errores de datos (truncado, NULL, conversión) fallarían igual en cada
+    reintento.
+    """
+    sqlstate = err.args[0] if err.args else ""
+    return (
+        sqlstate in ("40001", "HYT00", "HYT01")
+        or "(1205)" in str(err)
+        or "(1222)" in str(err)
+    )
+
+
+def is_connection_lost(err: pyodbc.Error) -> bool:
+    """Indica si la conexión se cayó (SQLSTATE 08xxx).
+
+    No se reintenta: la conexión y sus tablas temporales ya no existen, así que
+    la importación se detiene.
+    """
+    return bool(err.args) and str(err.args[0]).startswith("08")
 
 
 # ---------------------------------------------------------------------------
 # Funciones auxiliares para UPSERT de dimensiones
 # ---------------------------------------------------------------------------
-def get_or_create_client(cur: pyodbc.Cursor, account_fbid: int, name: str | None) -> int:
-    cur.execute("SELECT ClientID FROM dim_Clients WHERE AccountFBID = ?", account_fbid)
-    row = cur.fetchone()
-    if row:
-        return row.ClientID
-    cur.execute(
-        """
-        INSERT INTO dim_Clients (AccountFBID, ClientName)
-        OUTPUT INSERTED.ClientID
-        VALUES (?, ?)
-        """,
-        account_fbid,
-        name,
+# Cada dimensión se da de alta con un MERGE desde una tabla temporal que
+# contiene las claves naturales únicas del lote; luego un SELECT devuelve el
+# mapa clave natural -> clave sustituta.
+STAGE_CLIENTS_SQL = """
+    DROP TABLE IF EXISTS #stg_dim_Clients;
+    CREATE TABLE #stg_dim_Clients (
+        AccountFBID BIGINT NOT NULL PRIMARY KEY,
+        ClientName  NVARCHAR(255)
+    );
+"""
+INSERT_STG_CLIENTS_SQL = "INSERT INTO #stg_dim_Clients (AccountFBID, ClientName) VALUES (?, ?)"
+MERGE_CLIENTS_SQL = """
+    MERGE dim_Clients AS T
+    USING #stg_dim_Clients AS S ON T.AccountFBID = S.AccountFBID
+    WHEN NOT MATCHED THEN
+        INSERT (AccountFBID, ClientName) VALUES (S.AccountFBID, S.ClientName);
+"""
+SELECT_CLIENTS_SQL = """
+    SELECT S.AccountFBID, T.ClientID
+    FROM #stg_dim_Clients AS S
+    JOIN dim_Clients AS T ON T.AccountFBID = S.AccountFBID
+"""
+
+STAGE_CAMPAIGNS_SQL = """
+    DROP TABLE IF EXISTS #stg_dim_Campaigns;
+    CREATE TABLE #stg_dim_Campaigns (
+        CampaignFBID BIGINT NOT NULL PRIMARY KEY,
+        ClientID     INT    NOT NULL,
+        CampaignName NVARCHAR(255),
+        Objective    NVARCHAR(100)
+    );
+"""
+INSERT_STG_CAMPAIGNS_SQL = """
+    INSERT INTO #stg_dim_Campaigns (CampaignFBID, ClientID, CampaignName, Objective)
+    VALUES (?, ?, ?, ?)
+"""
+MERGE_CAMPAIGNS_SQL = """
+    MERGE dim_Campaigns AS T
+    USING #stg_dim_Campaigns AS S ON T.CampaignFBID = S.CampaignFBID
+    WHEN NOT MATCHED THEN
+        INSERT (ClientID, CampaignFBID, CampaignName, Objective)
+        VALUES (S.ClientID, S.CampaignFBID, S.CampaignName, S.Objective);
+"""
+SELECT_CAMPAIGNS_SQL = """
+    SELECT S.CampaignFBID, T.CampaignID
+    FROM #stg_dim_Campaigns AS S
+    JOIN dim_Campaigns AS T ON T.CampaignFBID = S.CampaignFBID
+"""
+
+STAGE_ADSETS_SQL = """
+    DROP TABLE IF EXISTS #stg_dim_AdSets;
+    CREATE TABLE #stg_dim_AdSets (
+        AdSetFBID  BIGINT NOT NULL PRIMARY KEY,
+        CampaignID INT    NOT NULL,
+        AdSetName  NVARCHAR(255)
+    );
+"""
+INSERT_STG_ADSETS_SQL = """
+    INSERT INTO #stg_dim_AdSets (AdSetFBID, CampaignID, AdSetName) VALUES (?, ?, ?)
+"""
+MERGE_ADSETS_SQL = """
+    MERGE dim_AdSets AS T
+    USING #stg_dim_AdSets AS S ON T.AdSetFBID = S.AdSetFBID
+    WHEN NOT MATCHED THEN
+        INSERT (CampaignID, AdSetFBID, AdSetName)
+        VALUES (S.CampaignID, S.AdSetFBID, S.AdSetName);
+"""
+SELECT_ADSETS_SQL = """
+    SELECT S.AdSetFBID, T.AdSetID
+    FROM #stg_dim_AdSets AS S
+    JOIN dim_AdSets AS T ON T.AdSetFBID = S.AdSetFBID
+"""
+
+STAGE_ADS_SQL = """
+    DROP TABLE IF EXISTS #stg_dim_Ads;
+    CREATE TABLE #stg_dim_Ads (
+        AdFBID         BIGINT NOT NULL PRIMARY KEY,
+        AdSetID        INT    NOT NULL,
+        AdName         NVARCHAR(500),
+        AdBody         NVARCHAR(MAX),
+        AdThumbnailURL NVARCHAR(1024),
+        PermanentLink  NVARCHAR(1024)
+    );
+"""
+INSERT_STG_ADS_SQL = """
+    INSERT INTO #stg_dim_Ads (AdFBID, AdSetID, AdName, AdBody, AdThumbnailURL, PermanentLink)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+MERGE_ADS_SQL = """
+    MERGE dim_Ads AS T
+    USING #stg_dim_Ads AS S ON T.AdFBID = S.AdFBID
+    WHEN NOT MATCHED THEN
+        INSERT (AdSetID, AdFBID, AdName, AdBody, AdThumbnailURL, PermanentLink)
+        VALUES (S.AdSetID, S.AdFBID, S.AdName, S.AdBody, S.AdThumbnailURL, S.PermanentLink);
+"""
+SELECT_ADS_SQL = """
+    SELECT S.AdFBID, T.AdID
+    FROM #stg_dim_Ads AS S
+    JOIN dim_Ads AS T ON T.AdFBID = S.AdFBID
+"""
+
+STAGE_DATES_SQL = """
+    DROP TABLE IF EXISTS #stg_dim_Date;
+    CREATE TABLE #stg_dim_Date (
+        DateID    INT  NOT NULL PRIMARY KEY,
+        FullDate  DATE NOT NULL,
+        Year      SMALLINT,
+        Month     TINYINT,
+        Day       TINYINT,
+        DayOfWeek TINYINT
+    );
+"""
+INSERT_STG_DATES_SQL = """
+    INSERT INTO #stg_dim_Date (DateID, FullDate, Year, Month, Day, DayOfWeek)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+MERGE_DATES_SQL = """
+    MERGE dim_Date AS T
+    USING #stg_dim_Date AS S ON T.DateID = S.DateID
+    WHEN NOT MATCHED THEN
+        INSERT (DateID, FullDate, Year, Month, Day, DayOfWeek)
+        VALUES (S.DateID, S.FullDate, S.Year, S.Month, S.Day, S.DayOfWeek);
+"""
+
+# Demografías y ubicaciones admiten NULL en la clave: INTERSECT compara NULL = NULL.
+STAGE_DEMOGRAPHICS_SQL = """
+    DROP TABLE IF EXISTS #stg_dim_Demographics;
+    CREATE TABLE #stg_dim_Demographics (
+        AgeBracket VARCHAR(50),
+        Gender     VARCHAR(50)
+    );
+"""
+INSERT_STG_DEMOGRAPHICS_SQL = "INSERT INTO #stg_dim_Demographics (AgeBracket, Gender) VALUES (?, ?)"
+MERGE_DEMOGRAPHICS_SQL = """
+    MERGE dim_Demographics AS T
+    USING #stg_dim_Demographics AS S
+       ON EXISTS (SELECT T.AgeBracket, T.Gender INTERSECT SELECT S.AgeBracket, S.Gender)
+    WHEN NOT MATCHED THEN
+        INSERT (AgeBracket, Gender) VALUES (S.AgeBracket, S.Gender);
+"""
+SELECT_DEMOGRAPHICS_SQL = """
+    SELECT S.AgeBracket, S.Gender, T.DemographicID
+    FROM #stg_dim_Demographics AS S
+    JOIN dim_Demographics AS T
+      ON EXISTS (SELECT T.AgeBracket, T.Gender INTERSECT SELECT S.AgeBracket, S.Gender)
+"""
+
+STAGE_PLACEMENTS_SQL = """
+    DROP TABLE IF EXISTS #stg_dim_Placements;
+    CREATE TABLE #stg_dim_Placements (
+        Platform NVARCHAR(100),
+        Device   NVARCHAR(100),
+        Position NVARCHAR(100)
+    );
+"""
+INSERT_STG_PLACEMENTS_SQL = """
+    INSERT INTO #stg_dim_Placements (Platform, Device, Position) VALUES (?, ?, ?)
+"""
+MERGE_PLACEMENTS_SQL = """
+    MERGE dim_Placements AS T
+    USING #stg_dim_Placements AS S
+       ON EXISTS (SELECT T.Platform, T.Device, T.Position
+                  INTERSECT SELECT S.Platform, S.Device, S.Position)
+    WHEN NOT MATCHED THEN
+        INSERT (Platform, Device, Position) VALUES (S.Platform, S.Device, S.Position);
+"""
+SELECT_PLACEMENTS_SQL = """
+    SELECT S.Platform, S.Device, S.Position, T.PlacementID
+    FROM #stg_dim_Placements AS S
+    JOIN dim_Placements AS T
+      ON EXISTS (SELECT T.Platform, T.Device, T.Position
+                 INTERSECT SELECT S.Platform, S.Device, S.Position)
+"""
+
+# Ancho de las columnas de texto de las dimensiones (igual en las tablas
+# temporales y en el esquema): los valores más largos se recortan antes del
+# alta para que una sola fila no aborte el lote.
+DIM_TEXT_WIDTHS = {
+    "ClientName": 255,
+    "CampaignName": 255,
+    "Objective": 100,
+    "AdSetName": 255,
+    "AdName": 500,
+    "AdThumbnailURL": 1024,
+    "PermanentLink": 1024,
+    "AgeBracket": 50,
+    "Gender": 50,
+    "Platform": 100,
+    "Device": 100,
+    "Position": 100,
+}
+
+
+def clip_dimension_text(df: pd.DataFrame) -> pd.DataFrame:
+    """Recorta los textos de dimensión al ancho de su columna en SQL Server."""
+    clipped = {
+        col: df[col].str.slice(0, width)
+        for col, width in DIM_TEXT_WIDTHS.items()
+        if col in df.columns and (df[col].str.len() > width).any()
+    }
+    return df.assign(**clipped) if clipped else df
+
+
+def to_records(frame: pd.DataFrame) -> list[tuple]:
+    """Convierte un DataFrame en tuplas de tipos nativos, con None en lugar de NaN."""
+    return list(frame.astype(object).where(frame.notna(), None).itertuples(index=False, name=None))
+
+
+def column_values(series: pd.Series) -> list:
+    """Devuelve la columna como lista de tipos nativos (pyodbc no enlaza escalares NumPy)."""
+    if series.hasnans:
+        return series.astype(object).where(series.notna(), None).tolist()
+    return series.tolist()
+
+
+def map_composite(frame: pd.DataFrame, mapping: dict) -> pd.Series:
+    """Equivalente de ``Series.map`` para claves compuestas (tuplas) en una sola pasada.
+
+    Usa ``MultiIndex.get_indexer`` en lugar de ``MultiIndex.map`` porque este
+    último no hace coincidir los NaN del lote con los None de las claves.
+    """
+    keys = pd.MultiIndex.from_tuples(list(mapping), names=list(frame.columns))
+    positions = keys.get_indexer(pd.MultiIndex.from_frame(frame))
+    if (positions < 0).any():
+        raise KeyError(f"Claves sin resolver en {list(frame.columns)}")
+    return pd.Series(list(mapping.values())).take(positions).set_axis(frame.index)
+
+
+# Cachés LRU clave natural -> clave sustituta compartidas entre lotes: las
+# claves ya conocidas no vuelven a pasar por la tabla temporal ni el MERGE.
+_client_cache: OrderedDict = OrderedDict()
+_campaign_cache: OrderedDict = OrderedDict()
+_adset_cache: OrderedDict = OrderedDict()
+_ad_cache: OrderedDict = OrderedDict()
+_date_cache: OrderedDict = OrderedDict()
+_demographic_cache: OrderedDict = OrderedDict()
+_placement_cache: OrderedDict = OrderedDict()
+
+
+def cache_get(cache: OrderedDict, key):
+    value = cache.get(key)
+    if value is not None:
+        cache.move_to_end(key)
+    return value
+
+
+def cache_put(cache: OrderedDict, key, value: int) -> None:
+    cache[key] = value
+    cache.move_to_end(key)
+    if len(cache) > CACHE_SIZE:
+        cache.popitem(last=False)
+
+
+def clear_caches() -> None:
+    """Vacía las cachés; se llama tras un rollback para no conservar IDs fantasma."""
+    for cache in (
+        _client_cache,
+        _campaign_cache,
+        _adset_cache,
+        _ad_cache,
+        _date_cache,
+        _demographic_cache,
+        _placement_cache,
+    ):
+        cache.clear()
+
+
+def merge_dimension(
+    cur: pyodbc.Cursor,
+    cache: OrderedDict,
+    key_len: int,
+    stage_sql: str,
+    insert_sql: str,
+    merge_sql: str,
+    select_sql: str | None,
+    rows: list[tuple],
+) -> dict:
+    """Resuelve las claves de ``rows`` desde la caché y da de alta el resto con un MERGE.
+
+    Las primeras ``key_len`` columnas de cada fila forman la clave natural (tupla
+    si es compuesta). El SELECT devuelve esas columnas seguidas de la clave
+    sustituta; sin SELECT, la clave natural es también la sustituta.
+    """
+    mapping = {}
+    missing = []
+    for row in rows:
+        key = row[0] if key_len == 1 else row[:key_len]
+        value = cache_get(cache, key)
+        if value is None:
+            missing.append(row)
+        else:
+            mapping[key] = value
+    if not missing:
+        return mapping
+
+    cur.execute(stage_sql)
+    cur.executemany(insert_sql, missing)
+    cur.execute(merge_sql)
+    if select_sql is None:
+        resolved = [(row[0], row[0]) for row in missing]
+    else:
+        resolved = cur.execute(select_sql).fetchall()
+    for row in resolved:
+        key = row[0] if key_len == 1 else tuple(row[:key_len])
+        mapping[key] = row[-1]
+        cache_put(cache, key, row[-1])
+    return mapping
+
+
+def upsert_clients(cur: pyodbc.Cursor, df: pd.DataFrame) -> dict:
+    unique = df[["AccountFBID", "ClientName"]].drop_duplicates("AccountFBID")
+    return merge_dimension(
+        cur, _client_cache, 1, STAGE_CLIENTS_SQL, INSERT_STG_CLIENTS_SQL, MERGE_CLIENTS_SQL, SELECT_CLIENTS_SQL,
+        to_records(unique),
     )
-    return cur.fetchone()[0]
-
-
-def get_or_create_campaign(
-    cur: pyodbc.Cursor, client_id: int, campaign_fbid: int, name: str | None, objective: str | None
-) -> int:
-    cur.execute("SELECT CampaignID FROM dim_Campaigns WHERE CampaignFBID = ?", campaign_fbid)
-    row = cur.fetchone()
-    if row:
-        return row.CampaignID
-    cur.execute(
-        """
-        INSERT INTO dim_Campaigns (ClientID, CampaignFBID, CampaignName, Objective)
-        OUTPUT INSERTED.CampaignID
-        VALUES (?, ?, ?, ?)
-        """,
-        client_id,
-        campaign_fbid,
-        name,
-        objective,
+
+
+def upsert_campaigns(cur: pyodbc.Cursor, df: pd.DataFrame, client_map: dict) -> dict:
+    unique = df[["CampaignFBID", "AccountFBID", "CampaignName", "Objective"]].drop_duplicates(
+        "CampaignFBID"
     )
-    return cur.fetchone()[0]
-
-
-def get_or_create_adset(
-    cur: pyodbc.Cursor, campaign_id: int, adset_fbid: int, name: str | None
-) -> int:
-    cur.execute("SELECT AdSetID FROM dim_AdSets WHERE AdSetFBID = ?", adset_fbid)
-    row = cur.fetchone()
-    if row:
-        return row.AdSetID
-    cur.execute(
-        """
-        INSERT INTO dim_AdSets (CampaignID, AdSetFBID, AdSetName)
-        OUTPUT INSERTED.AdSetID
-        VALUES (?, ?, ?)
-        """,
-        campaign_id,
-        adset_fbid,
-        name,
+    unique = unique.assign(ClientID=unique["AccountFBID"].map(client_map))
+    return merge_dimension(
+        cur, _campaign_cache, 1, STAGE_CAMPAIGNS_SQL, INSERT_STG_CAMPAIGNS_SQL, MERGE_CAMPAIGNS_SQL,
+        SELECT_CAMPAIGNS_SQL, to_records(unique[["CampaignFBID", "ClientID", "CampaignName", "Objective"]]),
     )
-    return cur.fetchone()[0]
 
 
-def get_or_create_ad(
-    cur: pyodbc.Cursor,
-    adset_id: int,
-    ad_fbid: int,
-    name: str | None,
-    body: str | None,
-    thumbnail_url: str | None,
-    permanent_link: str | None,
-) -> int:
-    cur.execute("SELECT AdID FROM dim_Ads WHERE AdFBID = ?", ad_fbid)
-    row = cur.fetchone()
-    if row:
-        return row.AdID
-    cur.execute(
-        """
-        INSERT INTO dim_Ads
-            (AdSetID, AdFBID, AdName, AdBody, AdThumbnailURL, PermanentLink)
-        OUTPUT INSERTED.AdID
-        VALUES (?, ?, ?, ?, ?, ?)
-        """,
-        adset_id,
-        ad_fbid,
-        name,
-        body,
-        thumbnail_url,
-        permanent_link,
+def upsert_adsets(cur: pyodbc.Cursor, df: pd.DataFrame, campaign_map: dict) -> dict:
+    unique = df[["AdSetFBID", "CampaignFBID", "AdSetName"]].drop_duplicates("AdSetFBID")
+    unique = unique.assign(CampaignID=unique["CampaignFBID"].map(campaign_map))
+    return merge_dimension(
+        cur, _adset_cache, 1, STAGE_ADSETS_SQL, INSERT_STG_ADSETS_SQL, MERGE_ADSETS_SQL, SELECT_ADSETS_SQL,
+        to_records(unique[["AdSetFBID", "CampaignID", "AdSetName"]]),
     )
-    return cur.fetchone()[0]
-
-
-def get_or_create_date(cur: pyodbc.Cursor, full_date: datetime) -> int:
-    date_id = int(full_date.strftime("%Y%m%d"))
-    cur.execute("SELECT DateID FROM dim_Date WHERE DateID = ?", date_id)
-    if cur.fetchone():
-        return date_id
-    cur.execute(
-        """
-        INSERT INTO dim_Date (DateID, FullDate, Year, Month, Day, DayOfWeek)
-        VALUES (?, ?, ?, ?, ?, ?)
-        """,
-        date_id,
-        full_date.date(),
-        full_date.year,
-        full_date.month,
-        full_date.day,
-        full_date.weekday() + 1,
+
+
+def upsert_ads(cur: pyodbc.Cursor, df: pd.DataFrame, adset_map: dict) -> dict:
+    unique = df[
+        ["AdFBID", "AdSetFBID", "AdName", "AdBody", "AdThumbnailURL", "PermanentLink"]
+    ].drop_duplicates("AdFBID")
+    unique = unique.assign(AdSetID=unique["AdSetFBID"].map(adset_map))
+    return merge_dimension(
+        cur, _ad_cache, 1, STAGE_ADS_SQL, INSERT_STG_ADS_SQL, MERGE_ADS_SQL, SELECT_ADS_SQL,
+        to_records(unique[["AdFBID", "AdSetID", "AdName", "AdBody", "AdThumbnailURL", "PermanentLink"]]),
     )
-    return date_id
 
 
-def get_or_create_demographic(
-    cur: pyodbc.Cursor, age_bracket: str | None, gender: str | None
-) -> int:
-    cur.execute(
-        "SELECT DemographicID FROM dim_Demographics WHERE AgeBracket = ? AND Gender = ?",
-        age_bracket,
-        gender,
+def add_date_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Convierte FullDate (YYYY-MM-DD) en ``DateID`` YYYYMMDD y sus campos con aritmética entera."""
+    date_id = df["FullDate"].str.slice(0, 10).str.replace("-", "", regex=False).astype("int32")
+    return df.assign(
+        DateID=date_id,
+        Year=date_id // 10000,
+        Month=date_id // 100 % 100,
+        Day=date_id % 100,
     )
-    row = cur.fetchone()
-    if row:
-        return row.DemographicID
-    cur.execute(
-        """
-        INSERT INTO dim_Demographics (AgeBracket, Gender)
-        OUTPUT INSERTED.DemographicID
-        VALUES (?, ?)
-        """,
-        age_bracket,
-        gender,
+
+
+def upsert_dates(cur: pyodbc.Cursor, df: pd.DataFrame) -> None:
+    unique = df[["DateID", "Year", "Month", "Day"]].drop_duplicates("DateID")
+    # Solo las fechas distintas del lote pasan por to_datetime.
+    full_date = pd.to_datetime(unique["DateID"].astype(str), format="%Y%m%d")
+    unique = unique.assign(FullDate=full_date, DayOfWeek=full_date.dt.weekday + 1)
+    merge_dimension(
+        cur, _date_cache, 1, STAGE_DATES_SQL, INSERT_STG_DATES_SQL, MERGE_DATES_SQL, None,
+        to_records(unique[["DateID", "FullDate", "Year", "Month", "Day", "DayOfWeek"]]),
     )
-    return cur.fetchone()[0]
-
-
-def get_or_create_placement(
-    cur: pyodbc.Cursor, platform: str | None, device: str | None, position: str | None
-) -> int:
-    cur.execute(
-        """
-        SELECT PlacementID FROM dim_Placements
-        WHERE Platform = ? AND Device = ? AND Position = ?
-        """,
-        platform,
-        device,
-        position,
+
+
+def upsert_demographics(cur: pyodbc.Cursor, df: pd.DataFrame) -> dict:
+    unique = df[["AgeBracket", "Gender"]].drop_duplicates()
+    return merge_dimension(
+        cur, _demographic_cache, 2, STAGE_DEMOGRAPHICS_SQL, INSERT_STG_DEMOGRAPHICS_SQL, MERGE_DEMOGRAPHICS_SQL,
+        SELECT_DEMOGRAPHICS_SQL, to_records(unique),
     )
-    row = cur.fetchone()
-    if row:
-        return row.PlacementID
-    cur.execute(
-        """
-        INSERT INTO dim_Placements (Platform, Device, Position)
-        OUTPUT INSERTED.PlacementID
-        VALUES (?, ?, ?)
-        """,
-        platform,
-        device,
-        position,
+
+
+def upsert_placements(cur: pyodbc.Cursor, df: pd.DataFrame) -> dict:
+    unique = df[["Platform", "Device", "Position"]].drop_duplicates()
+    return merge_dimension(
+        cur, _placement_cache, 3, STAGE_PLACEMENTS_SQL, INSERT_STG_PLACEMENTS_SQL, MERGE_PLACEMENTS_SQL,
+        SELECT_PLACEMENTS_SQL, to_records(unique),
     )
-    return cur.fetchone()[0]
+
+
+def resolve_dimensions(cur: pyodbc.Cursor, df: pd.DataFrame) -> dict[str, dict]:
+    """Da de alta las dimensiones del lote y devuelve los mapas de claves sustitutas."""
+    client_map = upsert_clients(cur, df)
+    campaign_map = upsert_campaigns(cur, df, client_map)
+    adset_map = upsert_adsets(cur, df, campaign_map)
+    upsert_dates(cur, df)
+    return {
+        "client": client_map,
+        "campaign": campaign_map,
+        "adset": adset_map,
+        "ad": upsert_ads(cur, df, adset_map),
+        "demographic": upsert_demographics(cur, df),
+        "placement": upsert_placements(cur, df),
+    }
+
+
+def resolve_rows(
+    conn: pyodbc.Connection, cur: pyodbc.Cursor, df: pd.DataFrame, label: str
+) -> tuple[pd.DataFrame, dict[str, dict]]:
+    """Resuelve las dimensiones fila a fila y descarta solo las filas que fallan.
+
+    Cada fila se confirma por separado: tras un rollback se vacían las cachés,
+    así que no quedan IDs de filas anteriores sin confirmar.
+    """
+    maps: dict[str, dict] = {}
+    keep = []
+    for pos in range(len(df)):
+        row = df.iloc[pos:pos + 1]
+        try:
+            row_maps = resolve_dimensions(cur, row)
+            conn.commit()
+        except pyodbc.Error as err:
+            if is_connection_lost(err):
+                raise
+            conn.rollback()
+            clear_caches()
+            log_error(
+                f"Fila descartada en {label} (AccountFBID={row['AccountFBID'].iat[0]}, "
+                f"AdFBID={row['AdFBID'].iat[0]}): {err}"
+            )
+            continue
+        for name, mapping in row_maps.items():
+            maps.setdefault(name, {}).update(mapping)
+        keep.append(pos)
+    return df.iloc[keep], maps
 
 
 # ---------------------------------------------------------------------------
 # Función principal de procesamiento
 # ---------------------------------------------------------------------------
-def process_row(cur: pyodbc.Cursor, row: pd.Series) -> None:
-    date_id = get_or_create_date(cur, row.FullDate)
-    client_id = get_or_create_client(cur, row.AccountFBID, row.ClientName)
-    campaign_id = get_or_create_campaign(cur, client_id, row.CampaignFBID, row.CampaignName, row.Objective)
-    adset_id = get_or_create_adset(cur, campaign_id, row.AdSetFBID, row.AdSetName)
-    ad_id = get_or_create_ad(
-        cur,
-        adset_id,
-        row.AdFBID,
-        row.AdName,
-        row.AdBody,
-        row.AdThumbnailURL,
-        row.PermanentLink,
-    )
-    demographic_id = get_or_create_demographic(cur, row.AgeBracket, row.Gender)
-    placement_id = get_or_create_placement(cur, row.Platform, row.Device, row.Position)
-
-    cur.execute(
-        """
-        DELETE FROM fact_Metrics
-        WHERE DateID=? AND AdID=? AND DemographicID=? AND PlacementID=?
-        """,
-        date_id,
-        ad_id,
-        demographic_id,
-        placement_id,
-    )
+FACT_COLS = [
+    "DateID", "ClientID", "CampaignID", "AdSetID", "AdID", "DemographicID", "PlacementID",
+    "Spend", "Impressions", "Reach", "Clicks", "Purchases", "PurchaseValue",
+    "VideoPlays_25_Pct", "VideoPlays_50_Pct", "VideoPlays_75_Pct",
+    "VideoPlays_95_Pct", "VideoPlays_100_Pct", "Results", "CostPerResult",
+]
+DECIMAL_METRIC_COLS = ["Spend", "PurchaseValue", "CostPerResult"]
+INT_METRIC_COLS = [c for c in FACT_COLS[7:] if c not in DECIMAL_METRIC_COLS]
+# Textos de baja cardinalidad: como category ocupan un código entero por fila y
+# drop_duplicates trabaja sobre los códigos. Las categorías cambian entre
+# bloques, así que las cachés siguen usando el texto como clave.
+CATEGORY_COLS = ["AgeBracket", "Gender", "Platform", "Device", "Position", "Objective"]
+# Textos libres de las dimensiones: sin tipo fijo, un bloque sin valores se
+# leería como float64 y uno con nombres numéricos ("2024") como int64.
+TEXT_COLS = [
+    "ClientName", "CampaignName", "AdSetName", "AdName", "AdBody", "AdThumbnailURL", "PermanentLink",
+]
+
+# Tipos fijos para read_csv: evita la inferencia por bloque y los upcasts a object.
+# Las métricas enteras son INT en fact_Metrics, así que basta con Int32; los
+# importes se quedan en float64 porque float32 no conserva DECIMAL(18,4).
+FBID_COLS = ["AccountFBID", "CampaignFBID", "AdSetFBID", "AdFBID"]
+DTYPES = {
+    "FullDate": "string",
+    **{c: "Int64" for c in FBID_COLS},
+    **{c: "Int32" for c in INT_METRIC_COLS},
+    **{c: "float64" for c in DECIMAL_METRIC_COLS},
+    **{c: "category" for c in CATEGORY_COLS},
+    **{c: "string" for c in TEXT_COLS},
+}
+# Filas sin alguna de estas columnas no se pueden asociar a sus dimensiones.
+KEY_COLS = ["FullDate", "AccountFBID", "CampaignFBID", "AdSetFBID", "AdFBID"]
 
-    cur.execute(
-        """
-        INSERT INTO fact_Metrics (
+# #staging_fact se crea una vez por conexión y se vacía en cada lote, de modo
+# que FACT_INSERT_SQL siempre apunta a la misma tabla y su plan se reutiliza.
+CREATE_STAGING_FACT_SQL = """
+    CREATE TABLE #staging_fact (
+        DateID INT NOT NULL, ClientID INT NOT NULL, CampaignID INT NOT NULL,
+        AdSetID INT NOT NULL, AdID INT NOT NULL, DemographicID INT NOT NULL,
+        PlacementID INT NOT NULL,
+        Spend DECIMAL(18,4), Impressions INT, Reach INT, Clicks INT, Purchases INT,
+        PurchaseValue DECIMAL(18,4),
+        VideoPlays_25_Pct INT, VideoPlays_50_Pct INT, VideoPlays_75_Pct INT,
+        VideoPlays_95_Pct INT, VideoPlays_100_Pct INT, Results INT,
+        CostPerResult DECIMAL(18,4)
+    );
+"""
+
+TRUNCATE_STAGING_FACT_SQL = "TRUNCATE TABLE #staging_fact"
+SAVE_FACT_BATCH_SQL = "SAVE TRANSACTION fact_batch"
+ROLLBACK_FACT_BATCH_SQL = "ROLLBACK TRANSACTION fact_batch"
+
+FACT_INSERT_SQL = """
+    INSERT INTO #staging_fact (
+        DateID, ClientID, CampaignID, AdSetID, AdID, DemographicID, PlacementID,
+        Spend, Impressions, Reach, Clicks, Purchases, PurchaseValue,
+        VideoPlays_25_Pct, VideoPlays_50_Pct, VideoPlays_75_Pct,
+        VideoPlays_95_Pct, VideoPlays_100_Pct, Results, CostPerResult
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# BULK INSERT no admite parámetros en la ruta: se interpola escapada.
+BULK_INSERT_STAGING_FACT_SQL = """
+    BULK INSERT #staging_fact FROM '{path}'
+    WITH (FIELDTERMINATOR = '0x01', ROWTERMINATOR = '0x0a', TABLOCK)
+"""
+
+# Un solo MERGE actualiza o inserta cada métrica: la fila nunca deja de existir
+# y se escribe una sola vez en el log. Sin HOLDLOCK: el reparto por campaña ya
+# garantiza un único escritor por clave, y los bloqueos de rango sobre el índice
+# único harían que los hilos se bloquearan entre sí.
+MERGE_FACT_SQL = """
+    MERGE fact_Metrics AS T
+    USING #staging_fact AS S
+       ON T.DateID = S.DateID AND T.AdID = S.AdID
+      AND T.DemographicID = S.DemographicID AND T.PlacementID = S.PlacementID
+    WHEN MATCHED THEN UPDATE SET
+        ClientID = S.ClientID,
+        CampaignID = S.CampaignID,
+        AdSetID = S.AdSetID,
+        Spend = S.Spend,
+        Impressions = S.Impressions,
+        Reach = S.Reach,
+        Clicks = S.Clicks,
+        Purchases = S.Purchases,
+        PurchaseValue = S.PurchaseValue,
+        VideoPlays_25_Pct = S.VideoPlays_25_Pct,
+        VideoPlays_50_Pct = S.VideoPlays_50_Pct,
+        VideoPlays_75_Pct = S.VideoPlays_75_Pct,
+        VideoPlays_95_Pct = S.VideoPlays_95_Pct,
+        VideoPlays_100_Pct = S.VideoPlays_100_Pct,
+        Results = S.Results,
+        CostPerResult = S.CostPerResult
+    WHEN NOT MATCHED THEN
+        INSERT (
             DateID, ClientID, CampaignID, AdSetID, AdID, DemographicID, PlacementID,
             Spend, Impressions, Reach, Clicks, Purchases, PurchaseValue,
             VideoPlays_25_Pct, VideoPlays_50_Pct, VideoPlays_75_Pct,
             VideoPlays_95_Pct, VideoPlays_100_Pct, Results, CostPerResult
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-        date_id,
-        client_id,
-        campaign_id,
-        adset_id,
-        ad_id,
-        demographic_id,
-        placement_id,
-        row.Spend,
-        row.Impressions,
-        row.Reach,
-        row.Clicks,
-        row.Purchases,
-        row.PurchaseValue,
-        row.VideoPlays_25_Pct,
-        row.VideoPlays_50_Pct,
-        row.VideoPlays_75_Pct,
-        row.VideoPlays_95_Pct,
-        row.VideoPlays_100_Pct,
-        row.Results,
-        row.CostPerResult,
+        )
+        VALUES (
+            S.DateID, S.ClientID, S.CampaignID, S.AdSetID, S.AdID, S.DemographicID,
+            S.PlacementID, S.Spend, S.Impressions, S.Reach, S.Clicks, S.Purchases,
+            S.PurchaseValue, S.VideoPlays_25_Pct, S.VideoPlays_50_Pct,
+            S.VideoPlays_75_Pct, S.VideoPlays_95_Pct, S.VideoPlays_100_Pct,
+            S.Results, S.CostPerResult
+        );
+"""
+
+# Grano de fact_Metrics en términos del CSV. El MERGE no admite dos filas de
+# origen para la misma fila destino, así que se conserva la última del lote.
+GRAIN_COLS = ["DateID", "AdFBID", "AgeBracket", "Gender", "Platform", "Device", "Position"]
+
+
+def fact_columns(batch: pd.DataFrame, maps: dict[str, dict]) -> list[list]:
+    """Arma las columnas del hecho, en el orden de FACT_COLS, usando los mapas de dimensiones.
+
+    Se construye un DataFrame estrecho solo con FACT_COLS, cada columna en su
+    propio arreglo contiguo: recorrerlas no toca las 86 columnas del lote (que
+    ``assign`` copiaría enteras en pandas < 3).
+    """
+    fact = pd.DataFrame(
+        {
+            "DateID": batch["DateID"],
+            "ClientID": batch["AccountFBID"].map(maps["client"]),
+            "CampaignID": batch["CampaignFBID"].map(maps["campaign"]),
+            "AdSetID": batch["AdSetFBID"].map(maps["adset"]),
+            "AdID": batch["AdFBID"].map(maps["ad"]),
+            "DemographicID": map_composite(batch[["AgeBracket", "Gender"]], maps["demographic"]),
+            "PlacementID": map_composite(
+                batch[["Platform", "Device", "Position"]], maps["placement"]
+            ),
+            **{col: batch[col] for col in FACT_COLS[7:]},
+        }
     )
+    return [column_values(fact[col]) for col in FACT_COLS]
+
+
+def fact_tuples(columns: list[list], size: int) -> Iterator[list[tuple]]:
+    """Genera las filas del hecho en tramos de ``size`` tuplas.
+
+    pyodbc solo usa ``fast_executemany`` con secuencias (un generador lo hace
+    ejecutar fila a fila), así que se le pasan listas acotadas en lugar de
+    materializar todas las tuplas del lote.
+    """
+    rows = zip(*columns)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def bulk_load_staging_fact(cur: pyodbc.Cursor, fact: pd.DataFrame) -> None:
+    """Escribe el lote en un archivo temporal y lo carga con BULK INSERT."""
+    fd, path = tempfile.mkstemp(suffix=".dat", dir=BULK_DIR)
+    os.close(fd)
+    try:
+        fact.astype({c: "Int64" for c in INT_METRIC_COLS}).to_csv(
+            path,
+            sep="\x01",
+            header=False,
+            index=False,
+            float_format="%.4f",
+            lineterminator="\n",
+        )
+        cur.execute(BULK_INSERT_STAGING_FACT_SQL.format(path=path.replace("'", "''")))
+    finally:
+        os.remove(path)
+
+
+class FactWorker(NamedTuple):
+    """Conexión de un hilo de carga con sus cursores persistentes."""
+
+    conn: pyodbc.Connection
+    cursor: pyodbc.Cursor
+    # Solo ejecuta FACT_INSERT_SQL: pyodbc reutiliza la sentencia preparada
+    # mientras el texto SQL no cambie entre llamadas.
+    insert_cursor: pyodbc.Cursor
+
+
+def open_fact_worker() -> FactWorker:
+    conn = connect()
+    cursor = conn.cursor()
+    cursor.execute(CREATE_STAGING_FACT_SQL)
+    conn.commit()
+    insert_cursor = conn.cursor()
+    insert_cursor.fast_executemany = True
+    return FactWorker(conn, cursor, insert_cursor)
+
+
+def close_fact_worker(worker: FactWorker) -> None:
+    worker.insert_cursor.close()
+    worker.cursor.close()
+    worker.conn.close()
+
+
+def load_facts(worker: FactWorker, batch: pd.DataFrame, maps: dict[str, dict]) -> None:
+    """Carga el lote en ``#staging_fact`` y lo aplica con un MERGE sobre ``fact_Metrics``."""
+    columns = fact_columns(batch, maps)
+    if BULK_DIR:
+        bulk_load_staging_fact(worker.cursor, pd.DataFrame(dict(zip(FACT_COLS, columns))))
+    else:
+        for rows in fact_tuples(columns, EXECUTEMANY_ROWS):
+            worker.insert_cursor.executemany(FACT_INSERT_SQL, rows)
+    worker.cursor.execute(MERGE_FACT_SQL)
+
+
+def try_load_facts(
+    worker: FactWorker, batch: pd.DataFrame, maps: dict[str, dict]
+) -> pyodbc.Error | None:
+    """Aplica el lote dentro de un savepoint; si falla, vuelve a él y devuelve el error.
+
+    El TRUNCATE va antes del SAVE TRANSACTION porque abre la transacción
+    implícita de la conexión (SAVE TRANSACTION exige una activa). Si el error
+    anula la transacción completa, ROLLBACK TRANSACTION falla y el error se
+    propaga para reintentar toda la partición.
+    """
+    worker.cursor.execute(TRUNCATE_STAGING_FACT_SQL)
+    worker.cursor.execute(SAVE_FACT_BATCH_SQL)
+    try:
+        load_facts(worker, batch, maps)
+    except pyodbc.Error as err:
+        if is_connection_lost(err):
+            raise
+        worker.cursor.execute(ROLLBACK_FACT_BATCH_SQL)
+        return err
+    return None
+
+
+def load_partition(
+    worker: FactWorker, batch: pd.DataFrame, maps: dict[str, dict], label: str
+) -> None:
+    """Carga una partición del lote con la conexión del hilo en una sola transacción.
+
+    Cada tramo de ``SAVEPOINT_ROWS`` filas va en su propio savepoint; si uno
+    falla se reintenta fila a fila para descartar y registrar solo las filas
+    erróneas. Los errores transitorios que anulan la transacción (p. ej. un
+    interbloqueo) reintentan la partición tras una espera creciente.
+    """
+    for attempt in range(1, BATCH_RETRIES + 2):
+        try:
+            for start in range(0, len(batch), SAVEPOINT_ROWS):
+                chunk = batch.iloc[start:start + SAVEPOINT_ROWS]
+                err = try_load_facts(worker, chunk, maps)
+                if err is None:
+                    continue
+                log_error(f"Error en {label}, filas {start + 1}-{start + len(chunk)}: {err}")
+                for pos in range(len(chunk)):
+                    row = chunk.iloc[pos:pos + 1]
+                    row_err = try_load_facts(worker, row, maps)
+                    if row_err is not None:
+                        log_error(
+                            f"Fila descartada en {label} (DateID={row['DateID'].iat[0]}, "
+                            f"AdFBID={row['AdFBID'].iat[0]}): {row_err}"
+                        )
+            worker.conn.commit()
+            return
+        except pyodbc.Error as err:
+            if is_connection_lost(err):
+                raise
+            worker.conn.rollback()
+            log_error(f"Error en {label} (intento {attempt}): {err}")
+            if not is_transient(err):
+                return
+            if attempt <= BATCH_RETRIES:
+                time.sleep(attempt)
+
+
+def partition_by_campaign(batch: pd.DataFrame) -> list[pd.DataFrame]:
+    """Parte el lote por CampaignFBID: cada hilo escribe hechos disjuntos y no hay interbloqueos."""
+    return [part for _, part in batch.groupby(batch["CampaignFBID"] % WORKERS, sort=False)]
+
+
+# ---------------------------------------------------------------------------
+# Lectura del reporte
+# ---------------------------------------------------------------------------
+def arrow_column_types() -> dict:
+    """Equivalente de ``DTYPES`` para el lector CSV de PyArrow.
+
+    Las métricas enteras se leen como float64 y ``arrow_int_schema`` las pasa a
+    int32, para aceptar "12.0" igual que pandas.
+    """
+    return {
+        "FullDate": pa.string(),
+        **{c: pa.int64() for c in FBID_COLS},
+        **{c: pa.float64() for c in INT_METRIC_COLS + DECIMAL_METRIC_COLS},
+        **{c: pa.dictionary(pa.int32(), pa.string()) for c in CATEGORY_COLS},
+        **{c: pa.string() for c in TEXT_COLS},
+    }
+
+
+def arrow_convert_options() -> pa_csv.ConvertOptions:
+    # Sin strings_can_be_null las celdas de texto vacías llegan como '' y no como NULL.
+    # Solo se leen las columnas con tipo fijo: el resto no se usa y su tipo
+    # inferido en el primer bloque podría no servir para los siguientes.
+    return pa_csv.ConvertOptions(
+        column_types=arrow_column_types(),
+        include_columns=list(DTYPES),
+        strings_can_be_null=True,
+    )
+
+
+def arrow_int_schema(schema: pa.Schema) -> pa.Schema:
+    """Esquema con las métricas enteras en int32; el cast falla si alguna tiene decimales."""
+    for c in INT_METRIC_COLS:
+        schema = schema.set(schema.get_field_index(c), pa.field(c, pa.int32()))
+    return schema
+
+
+def parse_fbid(text: str) -> int | None:
+    # int() rechaza "12.0" igual que PyArrow; con Int64, pandas lo aceptaría
+    # pasando por float64 y perdería precisión en los IDs de 18 dígitos.
+    return int(text) if text else None
+
+
+def arrow_to_pandas(table: pa.Table) -> pd.DataFrame:
+    # self_destruct libera cada columna Arrow al convertirla y evita el doble pico de memoria.
+    return table.to_pandas(
+        split_blocks=True,
+        self_destruct=True,
+        types_mapper={pa.int32(): pd.Int32Dtype(), pa.int64(): pd.Int64Dtype()}.get,
+    )
+
+
+def rebatch(batches: Iterator[pa.RecordBatch], size: int) -> Iterator[pa.Table]:
+    """Reagrupa los bloques de PyArrow (medidos en bytes) en tablas de ``size`` filas."""
+    pending: list[pa.RecordBatch] = []
+    rows = 0
+    for batch in batches:
+        pending.append(batch)
+        rows += batch.num_rows
+        while rows >= size:
+            table = pa.Table.from_batches(pending)
+            yield table.slice(0, size)
+            rest = table.slice(size)
+            pending = rest.to_batches()
+            rows = rest.num_rows
+    if rows:
+        yield pa.Table.from_batches(pending)
+
+
+def read_batches(path: str) -> Iterator[pd.DataFrame]:
+    """Abre el reporte y devuelve un iterador de DataFrames de ``BATCH_SIZE`` filas."""
+    if path.endswith(".parquet"):
+        if pa is None:
+            raise ImportError("Para leer archivos Parquet hace falta PyArrow")
+        batches = pq.ParquetFile(path).iter_batches(batch_size=BATCH_SIZE)
+        return (arrow_to_pandas(pa.Table.from_batches([b])) for b in batches)
+    if pa is None:
+        chunks = pd.read_csv(
+            path,
+            usecols=list(DTYPES),
+            dtype={c: dtype for c, dtype in DTYPES.items() if c not in FBID_COLS},
+            converters={c: parse_fbid for c in FBID_COLS},
+            chunksize=BATCH_SIZE,
+        )
+        return (chunk.astype({c: "Int64" for c in FBID_COLS}) for chunk in chunks)
+    reader = pa_csv.open_csv(path, convert_options=arrow_convert_options())
+    schema = arrow_int_schema(reader.schema)
+    batches = (batch.cast(schema) for batch in reader)
+    return (arrow_to_pandas(table) for table in rebatch(batches, BATCH_SIZE))
+
+
+def csv_to_parquet(csv_path: str, parquet_path: str) -> None:
+    """Convierte el CSV a Parquet una sola vez para acelerar las cargas repetidas."""
+    reader = pa_csv.open_csv(csv_path, convert_options=arrow_convert_options())
+    schema = arrow_int_schema(reader.schema)
+    with pq.ParquetWriter(parquet_path, schema) as writer:
+        for batch in reader:
+            writer.write_batch(batch.cast(schema))
 
 
 # ---------------------------------------------------------------------------
 # Punto de entrada
 # ---------------------------------------------------------------------------
+def log_error(message: str) -> None:
+    """Escribe en stderr sin romper la barra de progreso."""
+    if tqdm is None:
+        print(message, file=sys.stderr)
+    else:
+        tqdm.write(message, file=sys.stderr)
+
+
+def drop_missing_keys(df: pd.DataFrame, batch_no: int) -> pd.DataFrame:
+    """Descarta y registra las filas con alguna columna de ``KEY_COLS`` vacía."""
+    missing = df[KEY_COLS].isna().any(axis=1)
+    if missing.any():
+        log_error(f"{missing.sum()} filas sin clave descartadas en lote {batch_no}")
+        return df[~missing]
+    return df
+
+
+def drop_bad_dates(df: pd.DataFrame, batch_no: int) -> pd.DataFrame:
+    """Descarta y registra las filas cuyo FullDate no es una fecha YYYY-MM-DD válida.
+
+    ``add_date_columns`` solo quita los guiones: sin esta comprobación
+    "2024-1-5" daría DateID 202415 y "2024-02-30" rompería ``upsert_dates``.
+    """
+    text = df["FullDate"].str.slice(0, 10)
+    # Como en upsert_dates, solo las fechas distintas del lote pasan por to_datetime.
+    dates = pd.Series(text.unique(), dtype="string")
+    valid = dates.str.fullmatch(r"\d{4}-\d{2}-\d{2}") & pd.to_datetime(
+        dates, format="%Y-%m-%d", errors="coerce"
+    ).notna()
+    invalid = dates[~valid.astype(bool)]
+    if invalid.empty:
+        return df
+    bad = text.isin(invalid)
+    log_error(
+        f"{bad.sum()} filas con FullDate inválida descartadas en lote {batch_no} "
+        f"(p. ej. {invalid.iat[0]!r})"
+    )
+    return df[~bad]
+
+
+def process_batch(
+    conn: pyodbc.Connection,
+    executor: ThreadPoolExecutor,
+    pool: list[FactWorker],
+    batch: pd.DataFrame,
+    batch_no: int,
+) -> None:
+    """Resuelve las dimensiones del lote y reparte la carga de hechos entre los hilos.
+
+    Las dimensiones se resuelven en el hilo principal porque las cachés no se
+    comparten; solo la carga de hechos usa las conexiones del pool. Solo se
+    reintentan los errores transitorios, con la misma espera creciente que la
+    carga de hechos; ante un error de datos el lote se resuelve fila a fila
+    para descartar únicamente las filas erróneas. Una conexión caída se
+    propaga y detiene la importación.
+    """
+    if batch.empty:
+        return
+    maps = None
+    cursor = conn.cursor()
+    cursor.fast_executemany = True
+    try:
+        for attempt in range(1, BATCH_RETRIES + 2):
+            try:
+                maps = resolve_dimensions(cursor, batch)
+                conn.commit()
+                break
+            except pyodbc.Error as err:
+                if is_connection_lost(err):
+                    raise
+                conn.rollback()
+                clear_caches()
+                log_error(f"Error en dimensiones del lote {batch_no} (intento {attempt}): {err}")
+                if not is_transient(err):
+                    batch, maps = resolve_rows(conn, cursor, batch, f"lote {batch_no}")
+                    break
+                if attempt <= BATCH_RETRIES:
+                    time.sleep(attempt)
+    finally:
+        cursor.close()
+    if maps is None or batch.empty:
+        return
+
+    parts = partition_by_campaign(batch)
+    list(
+        executor.map(
+            load_partition,
+            pool,
+            parts,
+            [maps] * len(parts),
+            [f"lote {batch_no}, partición {i}" for i in range(1, len(parts) + 1)],
+        )
+    )
+
+
 def main() -> None:
     print("Conectando a la base de datos...")
     try:
-        conn = pyodbc.connect(CONN_STR, autocommit=False)
+        conn = connect()
+    except pyodbc.Error as err:
+        print(f"Error de conexión: {err}")
+        sys.exit(1)
+    pool: list[FactWorker] = []
+    try:
+        for _ in range(WORKERS):
+            pool.append(open_fact_worker())
     except pyodbc.Error as err:
         print(f"Error de conexión: {err}")
+        conn.close()
+        for worker in pool:
+            close_fact_worker(worker)
         sys.exit(1)
 
     try:
-        df = pd.read_csv(CSV_PATH, parse_dates=["FullDate"])
+        batches = read_batches(CSV_PATH)
     except Exception as err:  # noqa: BLE001
         print(f"No se pudo leer el CSV: {err}")
         conn.close()
+        for worker in pool:
+            close_fact_worker(worker)
         sys.exit(1)
 
     print(f"Iniciando importación de archivo {CSV_PATH}")
-    cursor = conn.cursor()
-    total = len(df)
 
-    for idx, row in enumerate(df.itertuples(index=False), start=1):
-        print(f"Procesando fila {idx} de {total}...")
-        try:
-            process_row(cursor, row)
-            conn.commit()
-        except pyodbc.Error as err:
-            conn.rollback()
-            print(f"Error en fila {idx}: {err}")
-
-    cursor.close()
-    conn.close()
+    progress = tqdm(unit=" filas", desc="Importando") if tqdm else None
+    batch_no = 0
+    chunks = enumerate(batches, start=1)
+    try:
+        with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+            while True:
+                # La lectura es perezosa: los errores de formato aparecen al pedir cada lote.
+                try:
+                    batch_no, chunk = next(chunks)
+                except StopIteration:
+                    break
+                except Exception as err:  # noqa: BLE001
+                    print(
+                        f"No se pudo leer el CSV en el lote {batch_no + 1} "
+                        f"(los anteriores ya están cargados): {err}"
+                    )
+                    sys.exit(1)
+                batch = drop_bad_dates(drop_missing_keys(chunk, batch_no), batch_no)
+                batch = clip_dimension_text(add_date_columns(batch)).drop_duplicates(
+                    GRAIN_COLS, keep="last"
+                )
+                if progress is None:
+                    print(f"Procesando lote {batch_no} ({len(batch)} filas)...")
+                process_batch(conn, executor, pool, batch, batch_no)
+                if progress is not None:
+                    progress.update(len(chunk))
+    except pyodbc.Error as err:
+        print(f"Conexión perdida en el lote {batch_no} (los anteriores ya están cargados): {err}")
+        sys.exit(1)
+    finally:
+        if progress is not None:
+            progress.close()
+        conn.close()
+        for worker in pool:
+            close_fact_worker(worker)
     print("Importación completada.")
 
 
@@ -104,6 +104,13 @@ BEGIN
     );
 END;
 GO
+-- No es UNIQUE: versiones anteriores del importador duplicaban las claves con NULL.
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_dim_Demographics_AgeBracket_Gender')
+BEGIN
+    CREATE NONCLUSTERED INDEX IX_dim_Demographics_AgeBracket_Gender
+        ON dbo.dim_Demographics(AgeBracket, Gender);
+END;
+GO
 
 IF OBJECT_ID('dbo.dim_Placements','U') IS NULL
 BEGIN
@@ -115,6 +122,12 @@ BEGIN
     );
 END;
 GO
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_dim_Placements_Platform_Device_Position')
+BEGIN
+    CREATE NONCLUSTERED INDEX IX_dim_Placements_Platform_Device_Position
+        ON dbo.dim_Placements(Platform, Device, Position);
+END;
+GO
 
 -- ============================================================
 -- Fact Table
@@ -159,3 +172,10 @@ BEGIN
         ON dbo.fact_Metrics(DateID, CampaignID, AdID);
 END;
 GO
+-- Grano de la tabla: clave del MERGE que aplica cada lote del importador.
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'UX_factMetrics_Date_Ad_Demographic_Placement')
+BEGIN
+    CREATE UNIQUE NONCLUSTERED INDEX UX_factMetrics_Date_Ad_Demographic_Placement
+        ON dbo.fact_Metrics(DateID, AdID, DemographicID, PlacementID);
+END;
+GO